@@ -1,22 +1,20 @@
 
 from __future__ import annotations
 from ..grammar import Grammar, ProductionRule, EPSILON
-from ..parser import Parser
+from ..parser import Parser, ParseError
 from typing import Sequence
-# TODO: Not able to handle null productions, need to check that
+import threading
 # NOTE: seems it is not possible to parse, as there will be conflicts
 
 
 class DottedProduction(ProductionRule):
     def __init__(self, dot_ptr: int, lhs: str, rhs: list[str]) -> None:
-        # rhs = [] if len(rhs) == 1 and rhs[0] == EPSILON else rhs
         super().__init__(lhs, rhs)
         self.dot_ptr = dot_ptr
-    # def is_null_production(self):
-    #     return
 
     def is_reduced(self):
-        return self.dot_ptr == len(self.rhs)
+        # a null production is reduced without shifting anything
+        return self.dot_ptr == len(self.rhs) or self.is_null_production()
 
     def rule(self):
         return super().__str__()
@@ -32,24 +30,30 @@ class DottedProduction(ProductionRule):
     # def is_right_recursive(self):
     #     return False if not len(self.rhs) else super().is_right_recursive()
 
-    def shift(self, grammar: Grammar):
-        if self.dot_ptr == len(self.rhs):
+    def advance(self) -> DottedProduction:
+        if self.is_reduced():
             raise RuntimeError(f"The production is already reduced")
-        return (self.rhs[self.dot_ptr], Closure(DottedProduction(self.dot_ptr + 1, self.lhs, self.rhs), grammar))
+        return DottedProduction(self.dot_ptr + 1, self.lhs, self.rhs)
 
 
 class Closure():
-    def __init__(self, rule: DottedProduction, grammar: Grammar) -> None:
-        self.rules: list[DottedProduction] = [rule]
-        if not rule.is_reduced():
+    def __init__(self, kernel: list[DottedProduction], grammar: Grammar) -> None:
+        self.rules: list[DottedProduction] = list(kernel)
+        self._seen: set[str] = set(str(rule) for rule in kernel)
+        for rule in kernel:
             self._expand_rules(rule, grammar)
 
     def _expand_rules(self, rule: DottedProduction, grammar: Grammar):
-        print(rule)
+        if rule.is_reduced():
+            return
         if rule.rhs[rule.dot_ptr] in grammar.non_terminals:
-            # include all the rules starting from it
+            # include all the rules starting from it, once each so that
+            # left recursive rules don't expand forever
             sub_sequent_rules = [DottedProduction(
                 0, rule.lhs, rule.rhs) for rule in grammar.rules[rule.rhs[rule.dot_ptr]]]
+            sub_sequent_rules = [
+                x for x in sub_sequent_rules if str(x) not in self._seen]
+            self._seen.update(str(x) for x in sub_sequent_rules)
             self.rules.extend(sub_sequent_rules)
             for sub_rule in sub_sequent_rules:
                 self._expand_rules(sub_rule, grammar)
@@ -61,87 +65,186 @@ class Closure():
         return str(self) == str(other)
 
 
-class LR0(Parser):
-    def __init__(self, grammar: Grammar, logging=False) -> None:
+class LR0Tables:
+    """
+    the item sets and ACTION/GOTO rows of a grammar, shared by every LR0
+    parser built over it. rows are never changed once published, with
+    lazy=True they are built on first use under a lock so concurrent
+    parsers build each item set only once.
+    """
+
+    def __init__(self, grammar: Grammar, logging=False, lazy=False, bypass_unit_rules=False) -> None:
         self.logging = logging
-        self.closures: list[Closure] = []
+        self.lazy = lazy
+        self.bypass_unit_rules = bypass_unit_rules
+        self._lock = threading.RLock()
+        self.kernels: list[list[DottedProduction]] = []
+        self.closures: list[Closure | None] = []
         self.transitions: dict[int, list[tuple[str, int]]] = dict()
-        self.grammar = grammar
-        self.table: list[dict[str, str | None]] | None = None
+        self.grammar = grammar.lowered_for_lr()
+        self.table: list[dict[str, str | None] | None] = []
+        self._closure_ids: dict[str, int] = dict()
+        self._terminals = list(self.grammar.terminals)
+        self._terminals.append("$")
+        self._columns = self._terminals + list(self.grammar.non_terminals)
+        self._rule_indices: dict[str, int] = dict()
+        for i, rule in enumerate(self.grammar.production_rules):
+            self._rule_indices.setdefault(str(rule), i)
         augmented_rule = DottedProduction(0, "S'", [self.grammar.start_symbol])
-        augmented_grammar = Closure(augmented_rule, grammar)
-        self.closures.append(augmented_grammar)
-        self._construct_dfa(augmented_grammar, 0)
-        self._construct_table()
+        self._closure_id([augmented_rule])
+        if not lazy:
+            self.freeze()
+            if self.logging:
+                self.print_dfa()
+                self.print_table()
+
+    def _closure_id(self, kernel: list[DottedProduction]) -> int:
+        # item sets are identified by their kernel, the closure is only
+        # expanded once the row of the item set is built
+        key = "\n".join(sorted(str(rule) for rule in kernel))
+        if key not in self._closure_ids:
+            self._closure_ids[key] = len(self.kernels)
+            self.kernels.append(kernel)
+            self.closures.append(None)
+            self.table.append(None)
+        return self._closure_ids[key]
+
+    def row(self, closure_id: int) -> dict[str, str | None]:
+        row = self.table[closure_id]
+        if row is None:
+            with self._lock:
+                # another parser may have built it while we waited
+                row = self.table[closure_id]
+                if row is None:
+                    row = self._construct_row(closure_id)
+                    self.table[closure_id] = row
+        return row
 
-    def _construct_dfa(self, closure: Closure, closure_id: int):
+    def _construct_row(self, closure_id: int) -> dict[str, str | None]:
+        closure = Closure(self.kernels[closure_id], self.grammar)
+        self.closures[closure_id] = closure
+        row: dict[str, str | None] = {x: None for x in self._columns}
+        kernels: dict[str, list[DottedProduction]] = dict()
         for rule in closure.rules:
             if not rule.is_reduced():
-                on, to = rule.shift(self.grammar)
-                existing = None
-                for i, c in enumerate(self.closures):
-                    if c == to:
-                        existing = i
-                        break
-                last_idx = len(self.closures)
-                # self.transitions.append(
-                #     (on, closure_id, last_idx if existing is None else existing))
-                if closure_id not in self.transitions:
-                    self.transitions[closure_id] = []
-                self.transitions[closure_id].append(
-                    (on, last_idx if existing is None else existing))
-                if existing is None:
-                    self.closures.append(to)
-                    self._construct_dfa(to, last_idx)
-        if self.logging:
-            self.print_dfa()
+                kernels.setdefault(rule.rhs[rule.dot_ptr], []).append(
+                    rule.advance())
+        if len(kernels):
+            self.transitions[closure_id] = []
+        targets = {on: self._closure_id(kernel)
+                   for on, kernel in kernels.items()}
+        for on, to in targets.items():
+            self.transitions[closure_id].append((on, to))
+            if self.bypass_unit_rules:
+                to = self._bypass(targets, to)
+            row[on] = f"S{to}"
+        for rule in closure.rules:
+            if not rule.is_reduced():
+                continue
+            if rule.lhs == "S'":
+                self._set_action(row, closure_id, "$", "accept")
+                continue
+            index = self._rule_indices.get(rule.rule())
+            if index is None:
+                raise ValueError(f"This won't occur")
+            action = f"r{index}"
+            if rule.lhs in self.grammar.loops and not rule.is_null_production():
+                action = f"l{index}"
+            for t in self._terminals:
+                self._set_action(row, closure_id, t, action, rule)
+        return row
+
+    def _set_action(self, row: dict[str, str | None], closure_id: int, on: str, action: str, rule: DottedProduction | None = None):
+        existing = row[on]
+        if existing is None or existing == action:
+            row[on] = action
+            return
+        if existing.startswith("S") and rule is not None:
+            preferred = self._resolve_conflict(on, rule)
+            if preferred == "reduce":
+                row[on] = action
+                return
+            if preferred == "shift":
+                return
+            if preferred == "error":
+                # kept as an entry so no later reduce can take the slot
+                row[on] = "error"
+                return
+        if existing.startswith("S"):
+            kind = "Shift-Reduce"
+        elif existing == "accept":
+            kind = "Accept-Reduce"
+        else:
+            kind = "Reduce-Reduce"
+        raise RuntimeError(
+            f"Failed to construct the table, {kind} conflict at I{closure_id} on {on}")
+
+    def _resolve_conflict(self, on: str, rule: DottedProduction) -> str | None:
+        # same rules as yacc, the higher level wins and on a tie the
+        # associativity decides, left reduces and right shifts
+        token_precedence = self.grammar.precedence_of(on)
+        rule_precedence = self.grammar.rule_precedence(rule)
+        if token_precedence is None or rule_precedence is None:
+            return None
+        if rule_precedence[0] != token_precedence[0]:
+            return "reduce" if rule_precedence[0] > token_precedence[0] else "shift"
+        if token_precedence[1] == "left":
+            return "reduce"
+        if token_precedence[1] == "right":
+            return "shift"
+        return "error"
+
+    def _unit_rule(self, closure_id: int) -> DottedProduction | None:
+        # a reduced item adds nothing to its closure, so the kernel is enough
+        rules = self.kernels[closure_id]
+        if len(rules) != 1 or not rules[0].is_reduced():
+            return None
+        rule = rules[0]
+        if rule.lhs == "S'" or rule.lhs in self.grammar.loops:
+            return None
+        if len(rule.rhs) != 1 or rule.rhs[0] not in self.grammar.non_terminals:
+            return None
+        return rule
+
+    def _bypass(self, targets: dict[str, int], to: int) -> int:
+        # follow chains like F -> T -> E while the target only reduces a unit rule
+        seen: set[int] = set()
+        while to not in seen:
+            seen.add(to)
+            rule = self._unit_rule(to)
+            if rule is None or rule.lhs not in targets:
+                break
+            to = targets[rule.lhs]
+        return to
+
+    def freeze(self) -> LR0Tables:
+        """Build every remaining item set, after this the table is complete."""
+        with self._lock:
+            closure_id = 0
+            while closure_id < len(self.kernels):
+                self.row(closure_id)
+                closure_id += 1
+            self.lazy = False
+        return self
 
     def print_dfa(self):
         for i, c in enumerate(self.closures):
             print(f" I{i} ".center(15, "-"))
-            for rule in c.rules:
+            for rule in (self.kernels[i] if c is None else c.rules):
                 print(f"|{str(rule).center(13)}|")
             print(f"".center(15, "-"))
             if i in self.transitions:
                 for on, to in self.transitions[i]:
                     print(f"I{i} --{on}--> I{to}")
+            elif self.table[i] is None:
+                print("Item is not built yet.")
             else:
                 print("Item is reduced.")
 
-    def _construct_table(self):
-        total_set = list(self.grammar.terminals)
-        total_set.append("$")
-        terminals = total_set.copy()
-        total_set.extend(self.grammar.non_terminals)
-        table: list[dict[str, str | None]] = [
-            {x: None for x in total_set} for _ in self.closures]
-        for i, t in self.transitions.items():
-            for on, to in t:
-                table[i][on] = f"S{to}"
-        for j, c in enumerate(self.closures):
-            if len(c.rules) == 1 and c.rules[0].is_reduced():
-                if any(x is None for x in table[i]):
-                    raise RuntimeError(
-                        f"Failed to construct the table, Shift-Reduce conflict at I{i}")
-                if c.rules[0].lhs == "S'":
-                    table[j]["$"] = "accept"
-                else:
-                    indices = [i for i, item in enumerate(
-                        self.grammar.production_rules) if str(item) == c.rules[0].rule()]
-                    if not len(indices):
-                        raise ValueError(f"This won't occur")
-                    for t in terminals:
-                        table[j][t] = f"r{indices[0]}"
-        self.table = table
-        if self.logging:
-            self.print_table()
-
     def print_table(self):
         total_set = list(self.grammar.terminals)
         total_set.append("$")
         total_set.extend(self.grammar.non_terminals)
-        if not self.table:
-            raise RuntimeError("Parsing table not constructed.")
         terminals = self.grammar.terminals.union({"$"})
         non_terminals = self.grammar.non_terminals
         cols_size = len(terminals) + len(non_terminals) + 1
@@ -156,6 +259,8 @@ class LR0(Parser):
         print(" " * (each_col_len) + "|" + row_str)
         print("-" * (cols_size * each_col_len + len(total_set)))
         for i, r in enumerate(self.table):
+            if r is None:
+                continue
             rows = [f"I{i}"]
             for c in total_set:
                 val = r[c]
@@ -164,14 +269,66 @@ class LR0(Parser):
             print(row_str)
             print("-"*len(row_str))
 
+
+class LR0(Parser):
+    """
+    with lazy=True the item sets and their ACTION/GOTO rows are only
+    built the first time the driver reaches them, so a parser over a
+    huge grammar only pays for the part of it the input actually uses.
+
+    loops of the grammar are parsed left recursively as L -> LX, once X
+    is complete the driver pops it and is back in the state of L ( l{n}
+    in the table ) instead of reducing and taking the GOTO again. X? is
+    inlined into its rule, see Grammar.lowered_for_lr. without lookahead
+    a rule or loop body still can't end in X? or X*, e.g. S -> ca? or
+    S -> x(ab*)*y conflict, the same as their plain BNF forms do.
+
+    shift-reduce conflicts are settled by the precedence declared on
+    the grammar. parse only recognises, no reduction feeds a tree, so
+    with bypass_unit_rules=True a GOTO into a state that can only reduce
+    a unit rule A -> B goes straight to the GOTO on A instead.
+
+    the parser only keeps its tables and the logging flag, all parsing
+    state lives in parse, so one parser can be shared between threads,
+    or cheap parsers made over the same tables with LR0.from_tables.
+    """
+
+    def __init__(self, grammar: Grammar, logging=False, lazy=False, bypass_unit_rules=False) -> None:
+        self._use(LR0Tables(grammar, logging, lazy, bypass_unit_rules), logging)
+
+    @classmethod
+    def from_tables(cls, tables: LR0Tables, logging=False) -> LR0:
+        """A parser over already compiled tables, sharing them with their other parsers."""
+        parser = cls.__new__(cls)
+        parser._use(tables, logging)
+        return parser
+
+    def _use(self, tables: LR0Tables, logging: bool):
+        self.tables = tables
+        self.logging = logging
+        self.grammar = tables.grammar
+
+    @property
+    def lazy(self) -> bool:
+        return self.tables.lazy
+
+    def freeze(self) -> LR0:
+        """Build every remaining item set, after this the table is complete."""
+        self.tables.freeze()
+        return self
+
+    def print_dfa(self):
+        self.tables.print_dfa()
+
+    def print_table(self):
+        self.tables.print_table()
+
     def parse(self, input: Sequence[str]) -> bool:
         stack: list[str | int] = []
         input = list(input)
         input.append("$")
         look_at = 0
         stack.append(0)
-        if not self.table:
-            raise RuntimeError("Parsing table not constructed.")
         if self.logging:
             print(
                 f"Start Parsing: tape -> {input[look_at:]}, stack -> {stack}")
@@ -180,12 +337,16 @@ class LR0(Parser):
             if type(top) != int:
                 raise RuntimeError(
                     f"Invalid stack top expected int found str.")
-            action = self.table[top][input[look_at]]
+            action = self.tables.row(top).get(input[look_at])
             if action is None:
-                raise RuntimeError(
+                raise ParseError(
                     f"Failed to parse the string, no action found for I{
                         top} at {input[look_at]}"
                 )
+            if action == "error":
+                raise ParseError(
+                    f"Failed to parse the string, {input[look_at]} is non associative at I{top}"
+                )
             if action == "accept":
                 if self.logging:
                     print("STRING IS ACCEPTED!!!")
@@ -194,26 +355,34 @@ class LR0(Parser):
                 if self.logging:
                     print(
                         f"Shift Found: I{
-                            top} --{input[look_at]}--> {action[-1]}"
+                            top} --{input[look_at]}--> {action[1:]}"
                     )
                 stack.append(input[look_at])
-                stack.append(int(action[-1]))
+                stack.append(int(action[1:]))
                 look_at += 1
             elif action.startswith("r"):
-                rule = self.grammar.production_rules[int(action[-1])]
+                rule = self.grammar.production_rules[int(action[1:])]
                 if not rule:
                     raise ValueError(f"No rule found, for {action}")
                 if self.logging:
                     print(f"Reduce Found: rule : {rule}")
-                for _ in range(len(rule.rhs) * 2):
-                    stack.pop()
-                state = self.table[int(stack[-1])][rule.lhs]
+                if not rule.is_null_production():
+                    for _ in range(len(rule.rhs) * 2):
+                        stack.pop()
+                state = self.tables.row(int(stack[-1]))[rule.lhs]
                 if state is None:
                     raise RuntimeError(
                         f"No state found at I{int(stack[-1])} {rule.lhs}"
                     )
                 stack.append(rule.lhs)
-                stack.append(int(state[-1]))
+                stack.append(int(state[1:]))
+            elif action.startswith("l"):
+                rule = self.grammar.production_rules[int(action[1:])]
+                if self.logging:
+                    print(f"Loop Found: rule : {rule}")
+                # pop the loop body, the state of the loop itself is on top then
+                for _ in range((len(rule.rhs) - 1) * 2):
+                    stack.pop()
             else:
                 raise RuntimeError(
                     f"No choice found"
@@ -233,3 +402,36 @@ if __name__ == "__main__":
     """, {"a", "b", "c"}, {"A", "B", "S"})
     lr0 = LR0(g, True)
     lr0.parse("aacbb")
+    g2 = Grammar.from_string(f"""
+    S -> a(bA)*c
+    A -> d
+    """, {"a", "b", "c", "d"}, {"A", "S"})
+    lr0_2 = LR0(g2, True)
+    lr0_2.parse("abdbdbdc")
+    g3 = Grammar.from_string(f"""
+    E -> E+E | E*E | (E) | id
+    """, {"+", "*", "(", ")", "id"}, {"E"}, "E", [("left", ["+"]), ("left", ["*"])])
+    lr0_3 = LR0(g3, True)
+    lr0_3.parse(["id", "+", "id", "*", "id", "+", "id"])
+    g4 = Grammar.from_string(f"""
+    E -> E+T | T
+    T -> F
+    F -> (E) | id
+    """, {"+", "(", ")", "id"}, {"E", "T", "F"}, "E")
+    lr0_4 = LR0(g4, True, bypass_unit_rules=True)
+    lr0_4.parse(["id", "+", "(", "id", ")"])
+    # EBNF forms LR(0) can and can't build, see the LR0 docstring
+    for rule in ["S -> ca?d", "S -> a?b?c", "S -> x(ab)*y", "S -> ca+d", "S -> ca?", "S -> b(ac?)+d", "S -> x(ab*)*y"]:
+        try:
+            LR0(Grammar.from_string(rule, {"a", "b", "c", "d", "x", "y"}, {"S"}))
+            print(f"{rule}: built")
+        except RuntimeError as e:
+            print(f"{rule}: {e}")
+    lazy_lr0 = LR0(g, lazy=True)
+    lazy_lr0.warm_up(["c"])
+    print(f"Built {sum(r is not None for r in lazy_lr0.tables.table)} of {
+          len(lazy_lr0.tables.kernels)} discovered item sets after warm up.")
+    lazy_lr0.parse("acb")
+    lazy_lr0.freeze().print_table()
+    shared = LR0.from_tables(lr0_3.tables)
+    print(shared.parse_many([["id", "*", "(", "id", "+", "id", ")"], ["id", "+"], ["id"]]))
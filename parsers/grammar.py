@@ -1,5 +1,9 @@
 from __future__ import annotations
 EPSILON = "ε"
+# EBNF operators, only recognised where the character isn't itself a symbol
+REPEAT, ONE_OR_MORE, OPTIONAL = "*", "+", "?"
+GROUP_OPEN, GROUP_CLOSE, ALTERNATIVE = "(", ")", "|"
+ASSOCIATIVITIES = ("left", "right", "nonassoc")
 
 
 class ProductionRule:
@@ -10,6 +14,9 @@ class ProductionRule:
     def __str__(self) -> str:
         return f"{self.lhs} -> {"".join(self.rhs)}"
 
+    def is_null_production(self):
+        return self.rhs == [EPSILON]
+
     def is_left_recursive(self):
         return self.rhs[0] == self.lhs
 
@@ -29,27 +36,84 @@ class ProductionRule:
         rhs_str = rhs_str.strip()
         if rhs_str == EPSILON:
             return ProductionRule(lhs, [EPSILON])
-        rhs: list[str] = []
-        i = 0
-        while i < len(rhs_str):
-            if rhs_str[i] in terminals or rhs_str[i] in non_terminals:
-                rhs.append(rhs_str[i])
-            else:
-                for j in range(i+1, len(rhs_str)+1):
-                    if rhs_str[i:j] in terminals or rhs_str[i:j] in non_terminals:
-                        rhs.append(rhs_str[i:j])
-                        i = j
-                        break
-            i += 1
+        rhs = [token for token, is_operator in tokenize(
+            rhs_str, terminals, non_terminals) if not is_operator]
         return ProductionRule(lhs, rhs)
 
 
+def tokenize(rhs_str: str, terminals: set[str], non_terminals: set[str]) -> list[tuple[str, bool]]:
+    """
+    splits a right hand side into (token, is_operator) pairs,
+    an EBNF operator character that is also declared as a symbol
+    is read as the symbol, e.g. F -> (E) keeps its brackets.
+    """
+    tokens: list[tuple[str, bool]] = []
+    operators = {REPEAT, ONE_OR_MORE, OPTIONAL,
+                 GROUP_OPEN, GROUP_CLOSE, ALTERNATIVE}
+    i = 0
+    while i < len(rhs_str):
+        if rhs_str[i] in terminals or rhs_str[i] in non_terminals:
+            tokens.append((rhs_str[i], False))
+            i += 1
+            continue
+        for j in range(i+2, len(rhs_str)+1):
+            if rhs_str[i:j] in terminals or rhs_str[i:j] in non_terminals:
+                tokens.append((rhs_str[i:j], False))
+                i = j
+                break
+        else:
+            if rhs_str[i] in operators:
+                tokens.append((rhs_str[i], True))
+            i += 1
+    return tokens
+
+
+def split_alternatives(tokens: list[tuple[str, bool]]) -> list[list[tuple[str, bool]]]:
+    """ splits tokens on every | that is not inside a group """
+    alternatives: list[list[tuple[str, bool]]] = [[]]
+    depth = 0
+    for token in tokens:
+        if token == (GROUP_OPEN, True):
+            depth += 1
+        elif token == (GROUP_CLOSE, True):
+            depth -= 1
+        elif token == (ALTERNATIVE, True) and depth == 0:
+            alternatives.append([])
+            continue
+        alternatives[-1].append(token)
+    return alternatives
+
+
 class Grammar:
-    def __init__(self, start_symbol: str, non_terminals: set[str], terminals: set[str], production_rules: list[ProductionRule]):
+    """
+    loops maps the non terminals generated for X* to their body X,
+    they are written as L -> XL | ε so every grammar utility keeps
+    working, parsers can run them as loops instead of recursion.
+    optionals does the same for the O -> X | ε generated for X?.
+
+    precedence declares operator levels lowest first, the same way
+    yacc does e.g. [("left", ["+"]), ("left", ["*"])], a rule takes
+    the level of its last terminal.
+    """
+
+    def __init__(self, start_symbol: str, non_terminals: set[str], terminals: set[str], production_rules: list[ProductionRule], loops: dict[str, list[str]] | None = None, precedence: list[tuple[str, list[str]]] | None = None, optionals: dict[str, list[str]] | None = None):
         self.start_symbol = start_symbol
         self.non_terminals = non_terminals
         self.terminals = terminals
         self.production_rules = production_rules
+        self.loops: dict[str, list[str]] = loops or dict()
+        self.optionals: dict[str, list[str]] = optionals or dict()
+        self.precedence = precedence or []
+        self._precedence_levels: dict[str, tuple[int, str]] = dict()
+        for level, (associativity, symbols) in enumerate(self.precedence):
+            if associativity not in ASSOCIATIVITIES:
+                raise ValueError(
+                    f"Unknown associativity '{associativity}', expected one of {", ".join(ASSOCIATIVITIES)}.")
+            for symbol in symbols:
+                if symbol not in self.terminals:
+                    raise ValueError(
+                        f"Precedence declared for '{symbol}' which is not a terminal.")
+                self._precedence_levels[symbol] = (level, associativity)
         self.rules: dict[str, list[ProductionRule]] = dict()
         for rule in self.production_rules:
             if not rule.lhs in self.rules:
@@ -63,24 +127,158 @@ class Grammar:
                     f"No production rule found for non-terminal '{non_terminal}'.")
 
     @staticmethod
-    def from_string(input: str, terminals: set[str], non_terminals: set[str], start_symbol: str | None = None) -> Grammar:
+    def from_string(input: str, terminals: set[str], non_terminals: set[str], start_symbol: str | None = None, precedence: list[tuple[str, list[str]]] | None = None) -> Grammar:
         rules = [r.strip() for r in input.split("\n") if len(r.strip())]
-        productions_rules = []
+        productions_rules: list[ProductionRule] = []
+        helper_rules: list[ProductionRule] = []
+        loops: dict[str, list[str]] = dict()
+        optionals: dict[str, list[str]] = dict()
+        all_non_terminals = non_terminals.copy()
         for rule in rules:
             lhs, rhs_combined = [x.strip() for x in rule.split("->")]
-            choices = [x.strip() for x in rhs_combined.split("|")]
-            for rhs in choices:
+            choices = split_alternatives(
+                tokenize(rhs_combined, terminals, non_terminals))
+            for tokens in choices:
+                if not any(is_operator for _, is_operator in tokens):
+                    productions_rules.append(ProductionRule(
+                        lhs, [token for token, _ in tokens] or [EPSILON]))
+                    continue
+                lowered = Grammar._lower(
+                    tokens, lhs, helper_rules, loops, optionals, all_non_terminals)
                 productions_rules.append(
-                    ProductionRule.from_string(
-                        f"{lhs} -> {rhs}", terminals, non_terminals)
-                )
+                    ProductionRule(lhs, lowered or [EPSILON]))
+        productions_rules.extend(helper_rules)
         return Grammar(
             start_symbol or productions_rules[0].lhs,
-            non_terminals,
+            all_non_terminals,
             terminals,
-            productions_rules
+            productions_rules,
+            loops,
+            precedence,
+            optionals
         )
 
+    @staticmethod
+    def _lower(tokens: list[tuple[str, bool]], lhs: str, helper_rules: list[ProductionRule], loops: dict[str, list[str]], optionals: dict[str, list[str]], non_terminals: set[str]) -> list[str]:
+        """
+        lowers one EBNF alternative into plain symbols, adding a helper
+        non terminal for every X* ( L -> XL | ε ) and X? ( O -> X | ε ),
+        X+ is written as X followed by X*. a group with alternatives
+        ( X | Y ) gets a helper G -> X | Y.
+        """
+        def helper() -> str:
+            i = 1
+            while f"{lhs}'{i}" in non_terminals:
+                i += 1
+            non_terminals.add(f"{lhs}'{i}")
+            return f"{lhs}'{i}"
+
+        sequence: list[str] = []
+        i = 0
+        while i < len(tokens):
+            token, is_operator = tokens[i]
+            if is_operator and token == GROUP_OPEN:
+                depth = 1
+                close = i + 1
+                while close < len(tokens):
+                    if tokens[close] == (GROUP_OPEN, True):
+                        depth += 1
+                    elif tokens[close] == (GROUP_CLOSE, True):
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    close += 1
+                if depth != 0:
+                    raise ValueError(f"Unbalanced group in a rule of {lhs}.")
+                alternatives = split_alternatives(tokens[i+1:close])
+                if len(alternatives) == 1:
+                    element = Grammar._lower(
+                        alternatives[0], lhs, helper_rules, loops, optionals, non_terminals)
+                else:
+                    group = helper()
+                    for alternative in alternatives:
+                        helper_rules.append(ProductionRule(group, Grammar._lower(
+                            alternative, lhs, helper_rules, loops, optionals, non_terminals) or [EPSILON]))
+                    element = [group]
+                i = close + 1
+            elif is_operator and token == GROUP_CLOSE:
+                raise ValueError(f"Unbalanced group in a rule of {lhs}.")
+            elif is_operator:
+                raise ValueError(
+                    f"Operator '{token}' has nothing to apply to in a rule of {lhs}.")
+            else:
+                element = [token]
+                i += 1
+            if not len(element):
+                continue
+            operator = tokens[i][0] if i < len(tokens) and tokens[i][1] else None
+            if operator not in (REPEAT, ONE_OR_MORE, OPTIONAL):
+                sequence.extend(element)
+                continue
+            i += 1
+            if operator == OPTIONAL:
+                optional = helper()
+                optionals[optional] = element
+                helper_rules.append(ProductionRule(optional, element))
+                helper_rules.append(ProductionRule(optional, [EPSILON]))
+                sequence.append(optional)
+                continue
+            if operator == ONE_OR_MORE:
+                sequence.extend(element)
+            loop = helper()
+            loops[loop] = element
+            helper_rules.append(ProductionRule(loop, element + [loop]))
+            helper_rules.append(ProductionRule(loop, [EPSILON]))
+            sequence.append(loop)
+        return sequence
+
+    def lowered_for_lr(self) -> Grammar:
+        """
+        the same grammar with every loop written as L -> LX | ε and every
+        X? inlined, A -> aX?b becomes A -> aXb | ab, so an LR parser only
+        reduces an empty rule where it can't shift instead.
+        """
+        production_rules: list[ProductionRule] = []
+        for rule in self.production_rules:
+            if rule.lhs in self.optionals:
+                continue
+            rhs = rule.rhs
+            if rule.lhs in self.loops and not rule.is_null_production():
+                rhs = [rule.lhs] + self.loops[rule.lhs]
+            seen: set[str] = set()
+            for choice in self._inline_optionals(rhs):
+                expanded = ProductionRule(rule.lhs, choice or [EPSILON])
+                if str(expanded) not in seen:
+                    seen.add(str(expanded))
+                    production_rules.append(expanded)
+        return Grammar(
+            self.start_symbol,
+            self.non_terminals - self.optionals.keys(),
+            self.terminals,
+            production_rules,
+            self.loops,
+            self.precedence
+        )
+
+    def _inline_optionals(self, rhs: list[str]) -> list[list[str]]:
+        choices: list[list[str]] = [[]]
+        for symbol in rhs:
+            if symbol in self.optionals:
+                options = self._inline_optionals(self.optionals[symbol]) + [[]]
+                choices = [c + o for c in choices for o in options]
+            else:
+                choices = [c + [symbol] for c in choices]
+        return choices
+
+    def precedence_of(self, symbol: str) -> tuple[int, str] | None:
+        return self._precedence_levels.get(symbol)
+
+    def rule_precedence(self, rule: ProductionRule) -> tuple[int, str] | None:
+        for symbol in reversed(rule.rhs):
+            if symbol in self.terminals:
+                return self.precedence_of(symbol)
+        return None
+
     def __str__(self) -> str:
         return "\n".join([str(rule) for rule in self.production_rules])
 
@@ -140,3 +338,25 @@ if __name__ == "__main__":
         """, {"a", "b", "c", "d", "e"}, {"S", "A", "B", "C", "D", "E"})
     print("Grammar: 5")
     print(g5)
+
+    g6 = Grammar.from_string("""
+        S -> a(bA)*c?
+        A -> d+
+        """, {"a", "b", "c", "d"}, {"S", "A"})
+    print("Grammar: 6")
+    print(g6)
+
+    # multi character symbols followed by operators
+    g7 = Grammar.from_string("S -> id*", {"id"}, {"S"})
+    assert str(g7) == "S -> S'1\nS'1 -> idS'1\nS'1 -> ε", str(g7)
+    g8 = Grammar.from_string("S -> (id)*", {"id"}, {"S"})
+    assert str(g8) == str(g7), str(g8)
+    g9 = Grammar.from_string("S -> id(,id)*", {"id", ","}, {"S"})
+    assert str(g9) == "S -> idS'1\nS'1 -> ,idS'1\nS'1 -> ε", str(g9)
+    print("Grammar: 7, 8, 9")
+    print(g9)
+
+    g10 = Grammar.from_string("S -> (a|b)*c | d", {"a", "b", "c", "d"}, {"S"})
+    assert str(g10) == "S -> S'2c\nS -> d\nS'1 -> a\nS'1 -> b\nS'2 -> S'1S'2\nS'2 -> ε", str(g10)
+    print("Grammar: 10")
+    print(g10)
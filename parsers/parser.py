@@ -1,7 +1,13 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Sequence
 from .grammar import Grammar
 
 
+class ParseError(RuntimeError):
+    """Raised when the input is rejected, as opposed to a broken grammar or table."""
+
+
 class Parser(ABC):
     def __init__(self, grammar: Grammar) -> None:
         self.grammar = grammar
@@ -11,3 +17,21 @@ class Parser(ABC):
     def parse(self, input: str) -> bool:
         """Parse the given input string and return whether it is valid."""
         pass
+
+    def accepts(self, input: Sequence[str]) -> bool:
+        """Same as parse, but a rejected input returns False instead of raising."""
+        try:
+            return self.parse(input)
+        except ParseError:
+            return False
+
+    def warm_up(self, corpus: Iterable[Sequence[str]]) -> None:
+        """Parse each sample so the table entries it touches are built ahead of time."""
+        for sample in corpus:
+            # a rejected sample has still built the entries it reached
+            self.accepts(sample)
+
+    def parse_many(self, inputs: Iterable[Sequence[str]], max_workers: int | None = None) -> list[bool]:
+        """Parse the inputs on a thread pool sharing this parser, results keep the input order."""
+        with ThreadPoolExecutor(max_workers) as executor:
+            return list(executor.map(self.accepts, inputs))
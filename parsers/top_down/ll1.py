@@ -1,77 +1,131 @@
+from __future__ import annotations
 from ..grammar import Grammar, ProductionRule, EPSILON
 from ..parser import Parser
-from ..utils import First, Follow, is_left_factored
+from ..utils import FirstMap, Follow, is_left_factored
 from typing import Sequence
+import threading
 
 
-class LL1(Parser):
-    def __init__(self, grammar: Grammar, logging=False) -> None:
-        if not is_left_factored(grammar) or grammar.is_left_recursive() or grammar.is_certainly_ambiguous():
+class LoopRule(ProductionRule):
+    """
+    table entry for the body of a loop L -> XL, the driver keeps L on
+    the stack, matches the terminals X starts with straight off the
+    tape and only pushes the rest of X, so a list of terminals takes
+    one step per element instead of an expansion and a match.
+    """
+
+    def __str__(self) -> str:
+        return f"{self.lhs} -> ({"".join(self.rhs)})*"
+
+
+class LL1Tables:
+    """
+    the compiled parse table of a grammar, shared by every LL1 parser
+    built over it. rows are never changed once published, with lazy=True
+    they are built on first use under a lock so concurrent parsers build
+    each row only once.
+    """
+
+    def __init__(self, grammar: Grammar, logging=False, lazy=False) -> None:
+        if not lazy and not is_left_factored(grammar):
             raise ValueError(f"{grammar} is not suitable for LL0 parsing.")
-        super().__init__(grammar)
+        if grammar.is_left_recursive() or grammar.is_certainly_ambiguous():
+            raise ValueError(f"{grammar} is not suitable for LL0 parsing.")
+        self.grammar = grammar
         self.logging = logging
-        self._first_map: dict[str, set[str]] | None = None
-        self._follow_map:  dict[str, set[str]] | None = None
-        self._parse_table: dict[str, dict[str, ProductionRule |
-                                          None]] = self._construct_parse_table()
+        self.lazy = lazy
+        self._lock = threading.RLock()
+        self._first_map = FirstMap(grammar)
+        self._follow_map: dict[str, set[str]] = dict()
+        self._terminals: set[str] = self.grammar.terminals.copy()
+        self._terminals.add('$')
+        self.parse_table: dict[str, dict[str, ProductionRule |
+                                         None]] = dict()
+        if not lazy:
+            self._construct_parse_table()
 
     def calculate_first(self):
-        if self._first_map:
+        symbols = self.grammar.terminals | self.grammar.non_terminals
+        with self._lock:
+            if self._first_map.keys() >= symbols:
+                return self._first_map
+            for symbol in symbols:
+                self._first_map[symbol]
+            if self.logging:
+                for e in self._first_map:
+                    print(f"First({e}) -> {{ {" , ".join(self._first_map[e])} }}")
             return self._first_map
-        first_map: dict[str, set[str]] = dict()
-        for t in self.grammar.terminals:
-            first_map[t] = First(t, self.grammar)
-        for nt in self.grammar.non_terminals:
-            first_map[nt] = First(
-                nt, self.grammar) if nt not in first_map else first_map[nt]
-        if self.logging:
-            for e in first_map:
-                print(f"First({e}) -> {{ {" , ".join(first_map[e])} }}")
-        self._first_map = first_map
-        return first_map
 
     def calculate_follow(self):
-        if self._follow_map:
+        with self._lock:
+            if self._follow_map.keys() >= self.grammar.non_terminals:
+                return self._follow_map
+            for nt in self.grammar.non_terminals:
+                self._follow(nt)
+            if self.logging:
+                for e in self._follow_map:
+                    print(f"Follow({e}) -> {{ {" , ".join(self._follow_map[e])} }}")
             return self._follow_map
-        first_dict = self.calculate_first()
-        follow_dict: dict[str, set[str]] = dict()
-        for nt in self.grammar.non_terminals:
-            follow_dict[nt] = Follow(nt, self.grammar, first_dict)
-        if self.logging:
-            for e in follow_dict:
-                print(f"Follow({e}) -> {{ {" , ".join(follow_dict[e])} }}")
-        self._follow_map = follow_dict
-        return follow_dict
+
+    def _follow(self, nt: str) -> set[str]:
+        if nt not in self._follow_map:
+            self._follow_map[nt] = Follow(nt, self.grammar, self._first_map)
+        return self._follow_map[nt]
 
     def _construct_parse_table(self):
         if self.logging:
             print(f"Grammer: \n{self.grammar}\n",)
-        first_dict = self.calculate_first()
-        follow_dict = self.calculate_follow()
-        terminals: set[str] = self.grammar.terminals.copy()
-        terminals.add('$')
-        non_terminals = self.grammar.non_terminals.copy()
-        table: dict[str, dict[str, ProductionRule | None]] = {nt: {t: None for t in terminals}
-                                                              for nt in non_terminals}
-        for lhs, rules in self.grammar.rules.items():
-            choices = [rule.rhs for rule in rules]
-            for choice in choices:
-                if choice[0] == EPSILON:
-                    follow_of_choice = follow_dict[lhs]
-                    for each_follow_of_choice in follow_of_choice:
-                        table[lhs][each_follow_of_choice] = ProductionRule(
-                            lhs, choice)
-                    continue
-                first_of_choice = first_dict[choice[0]]
-                for each_first_of_choice in first_of_choice:
-                    if each_first_of_choice == EPSILON:
-                        continue
-                    else:
-                        table[lhs][each_first_of_choice] = ProductionRule(
-                            lhs, choice)
+        self.calculate_first()
+        self.calculate_follow()
+        self.freeze()
         if self.logging:
-            self._print_parse_table(table, terminals)
-        return table
+            self._print_parse_table(self.parse_table, self._terminals)
+        return self.parse_table
+
+    def row(self, nt: str) -> dict[str, ProductionRule | None]:
+        row = self.parse_table.get(nt)
+        if row is None:
+            with self._lock:
+                # another parser may have built it while we waited
+                row = self.parse_table.get(nt)
+                if row is None:
+                    row = self._construct_row(nt)
+                    self.parse_table[nt] = row
+        return row
+
+    def _construct_row(self, lhs: str) -> dict[str, ProductionRule | None]:
+        row: dict[str, ProductionRule | None] = {
+            t: None for t in self._terminals}
+        for rule in self.grammar.rules[lhs]:
+            choice = rule.rhs
+            # First of the whole choice, and Follow of lhs if all of it can vanish
+            lookaheads: set[str] = set()
+            for symbol in choice:
+                first = self._first_map[symbol]
+                lookaheads.update(first - {EPSILON})
+                if EPSILON not in first:
+                    break
+            else:
+                lookaheads.update(self._follow(lhs))
+            if lhs in self.grammar.loops and choice[0] != EPSILON:
+                entry = LoopRule(lhs, choice[:-1])
+            else:
+                entry = ProductionRule(lhs, choice)
+            for lookahead in lookaheads:
+                existing = row[lookahead]
+                if existing is not None and existing != entry:
+                    raise ValueError(
+                        f"{self.grammar} is not suitable for LL0 parsing, conflict at {lhs} on {lookahead}.")
+                row[lookahead] = entry
+        return row
+
+    def freeze(self) -> LL1Tables:
+        """Build every remaining row, after this the table is complete."""
+        with self._lock:
+            for nt in self.grammar.non_terminals:
+                self.row(nt)
+            self.lazy = False
+        return self
 
     def _print_parse_table(self, table: dict[str, dict[str, ProductionRule | None]], cols: set[str]):
         columns = [""]
@@ -89,12 +143,53 @@ class LL1(Parser):
             print(row_str)
             print("-"*len(row_str))
 
+
+class LL1(Parser):
+    """
+    with lazy=True a row of the parse table is only built the first time
+    the driver expands its non terminal, the grammar checks are done per
+    row as well so construction itself does no work.
+
+    the parser only keeps its tables and the logging flag, all parsing
+    state lives in parse, so one parser can be shared between threads,
+    or cheap parsers made over the same tables with LL1.from_tables.
+    """
+
+    def __init__(self, grammar: Grammar, logging=False, lazy=False) -> None:
+        self._use(LL1Tables(grammar, logging, lazy), logging)
+
+    @classmethod
+    def from_tables(cls, tables: LL1Tables, logging=False) -> LL1:
+        """A parser over already compiled tables, sharing them with their other parsers."""
+        parser = cls.__new__(cls)
+        parser._use(tables, logging)
+        return parser
+
+    def _use(self, tables: LL1Tables, logging: bool):
+        self.tables = tables
+        super().__init__(tables.grammar)
+        self.logging = logging
+
+    @property
+    def lazy(self) -> bool:
+        return self.tables.lazy
+
+    def calculate_first(self):
+        return self.tables.calculate_first()
+
+    def calculate_follow(self):
+        return self.tables.calculate_follow()
+
+    def freeze(self) -> LL1:
+        """Build every remaining row, after this the table is complete."""
+        self.tables.freeze()
+        return self
+
     def parse(self, input: Sequence[str]) -> bool:
         tape = list(x for x in input)
         tape.append("$")
         tape_ptr = 0
         stack: list[str] = []
-        table = self._parse_table
         stack.append("$")
         stack.append(self.grammar.start_symbol)
         if self.logging:
@@ -111,7 +206,12 @@ class LL1(Parser):
             else:
                 if self.logging:
                     print("Found Non Terminal: looking for rules to move forward:")
-                rule = table[stack[-1]][tape[tape_ptr]]
+                if stack[-1] not in self.grammar.non_terminals:
+                    if self.logging:
+                        print(
+                            f"Failed to parse: expected {stack[-1]} found {tape[tape_ptr]}")
+                    return False
+                rule = self.tables.row(stack[-1]).get(tape[tape_ptr])
                 if rule is None:
                     if self.logging:
                         print(
@@ -121,9 +221,17 @@ class LL1(Parser):
                     return False
                 if self.logging:
                     print(f"Rule Found: {rule}, expanding rule:")
-                stack.pop()
-                if rule.rhs[0] != EPSILON:
-                    stack.extend(reversed(rule.rhs))
+                if isinstance(rule, LoopRule):
+                    # the loop stays below its body for the next element
+                    matched = 0
+                    while matched < len(rule.rhs) and rule.rhs[matched] == tape[tape_ptr]:
+                        matched += 1
+                        tape_ptr += 1
+                    stack.extend(reversed(rule.rhs[matched:]))
+                else:
+                    stack.pop()
+                    if rule.rhs[0] != EPSILON:
+                        stack.extend(reversed(rule.rhs))
                 if self.logging:
                     print(f"Snap: tape -> {tape[tape_ptr:]}, stack -> {stack}")
         if (tape_ptr == len(tape)):
@@ -156,3 +264,17 @@ if __name__ == '__main__':
     """, {"+", "*", "(", ")", "id"}, {"E", "P", "T", "Q", "F"}, "E")
     ll1_2 = LL1(g2, True)
     ll1_2.parse(["id", "+", "id", "*", "id"])
+    g3 = Grammar.from_string(f"""
+    S -> B(aB)*
+    B -> D(bD)*
+    D -> cSd | e
+    """, {"a", "b", "c", "d", "e"}, {"S", "B", "D"})
+    ll1_3 = LL1(g3, True)
+    ll1_3.parse("cebeaed")
+    lazy_ll1 = LL1(g2, lazy=True)
+    lazy_ll1.warm_up([["id", "*", "id"]])
+    print(f"Built rows after warm up: {sorted(lazy_ll1.tables.parse_table)}")
+    lazy_ll1.parse(["(", "id", "+", "id", ")"])
+    lazy_ll1.freeze()
+    shared = LL1.from_tables(ll1_3.tables)
+    print(shared.parse_many(["cebeaed", "e", "ebebe", "ca"]))
@@ -65,6 +65,19 @@ def Follow(symbol: str, grammar: Grammar, first_map: dict[str, set[str]]):
     return follow_set
 
 
+class FirstMap(dict[str, set[str]]):
+    """ First sets of a grammar, each one computed the first time it is looked up """
+
+    def __init__(self, grammar: Grammar) -> None:
+        super().__init__()
+        self.grammar = grammar
+
+    def __missing__(self, symbol: str) -> set[str]:
+        first_set = First(symbol, self.grammar)
+        self[symbol] = first_set
+        return first_set
+
+
 def is_left_factored(g: Grammar):
     """
     if two rules of any production has common prefix 